@@ -1,13 +1,480 @@
+import io
 import os
+import sys
+import re
+import math
+import glob
+import json
+import bisect
+import hashlib
+import itertools
+import contextlib
+import tracemalloc
+import functools
+import asyncio
+import argparse
 import time
-import shutil
+import zipfile
+import tempfile
 import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+from array import array
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
+try:
+    import numpy
+except ImportError:  # numpy 为可选依赖，没有时使用纯 Python 计算
+    numpy = None
+
+EARTH_RADIUS = 6371008.8  # 地球平均半径，米
+CACHE_VERSION = 1  # 输出格式变化时递增，使旧缓存失效
+SPOOL_SIZE = 8 * 1024 * 1024  # waylines.wpml 写入内存临时文件的上限，超过后转存磁盘
+
+Waypoint = namedtuple("Waypoint", ["lon", "lat", "alt", "heading", "speed", "actions"])  # 航点，数值均为 float
+Action = namedtuple("Action", ["action", "label", "param", "targetMode"])  # 航点动作
+
+
+def localName(tag):
+    # 去掉命名空间前缀 {uri}
+    return tag.rsplit("}", 1)[-1]
+
+
+def formatNumber(value):
+    # 以最短的可还原形式输出数值，整数去掉 .0
+    text = repr(float(value))
+    return text[:-2] if text.endswith(".0") else text
+
+
+FIELD = "\x01%s\x02"  # 节点文本中的占位符，makeFormat 将其转为 {名称}
+
+
+def makeFormat(element):
+    # 序列化节点为 str.format 格式串，写出时只需填入各字段
+    text = ET.tostring(element, encoding="unicode").replace("{", "{{").replace("}", "}}")
+    return re.sub("\x01(\\w+)\x02", r"{\1}", text)
+
+
+ACTIONS = {}  # DJI Pilot 动作名 -> (actionActuatorFunc 与 actionActuatorFuncParam 的 xml 格式串，{param} 处填入 kml 中该动作的 param；param 为空时的 xml)
+
+
+def registerAction(name, func, params=()):
+    # 注册航点动作，params 为 [(标签, 文本)]，文本为 None 时使用 kml 中该动作的 param
+    # 注册时即序列化，写出时不再构建、序列化节点
+    actionActuatorFunc = ET.Element("wpml:actionActuatorFunc")
+    actionActuatorFunc.text = func
+    actionActuatorFuncParam = ET.Element("wpml:actionActuatorFuncParam")
+    empty = ET.Element("wpml:actionActuatorFuncParam")
+    for tag, text in params:
+        ET.SubElement(actionActuatorFuncParam, tag).text = FIELD % "param" if text is None else text
+        ET.SubElement(empty, tag).text = text
+    func = ET.tostring(actionActuatorFunc, encoding="unicode")
+    ACTIONS[name] = (makeFormat(actionActuatorFunc) + makeFormat(actionActuatorFuncParam), func + ET.tostring(empty, encoding="unicode"))
+
+
+registerAction("ShootPhoto", "takePhoto", [  # 单拍
+    ("wpml:payloadPositionIndex", "0"),  # 负载挂载位置
+    ("wpml:fileSuffix", ""),  # 拍摄照片文件后缀
+    # ("wpml:payloadLensIndex", "1"),  # 拍摄照片存储类型
+    ("wpml:useGlobalPayloadLensIndex", "1"),  # 是否使用全局存储类型
+])
+registerAction("StartRecording", "startRecord", [  # 开始录像
+    ("wpml:payloadPositionIndex", "0"),  # 负载挂载位置
+    ("wpml:fileSuffix", ""),  # 拍摄照片文件后缀
+    # ("wpml:payloadLensIndex", "1"),  # 视频存储类型
+    ("wpml:useGlobalPayloadLensIndex", "1"),  # 是否使用全局存储类型
+])
+registerAction("StopRecording", "stopRecord", [  # 结束录像
+    ("wpml:payloadPositionIndex", "0"),  # 负载挂载位置
+    ("wpml:payloadLensIndex", "zoom"),  # 视频存储类型
+])
+registerAction("focus", "focus", [  # 对焦
+    ("wpml:payloadPositionIndex", "0"),  # 负载挂载位置
+    ("wpml:isPointFocus", "0"),  # 是否点对焦
+    ("wpml:focusX", "0.5"),  # 对焦点位置
+    ("wpml:focusY", "0.5"),  # 对焦点位置
+    ("wpml:focusRegionWidth", "0"),  # 对焦区域宽度比
+    ("wpml:focusRegionHeight", "0"),  # 对焦区域高度比
+    ("wpml:isInfiniteFocus", "0"),  # 是否无穷远对焦
+])
+registerAction("zoom", "zoom", [  # 变焦
+    ("wpml:payloadPositionIndex", "0"),  # 负载挂载位置
+    ("wpml:focalLength", "50"),  # 变焦焦距
+])
+registerAction("customDirName", "customDirName", [  # 创建新文件夹
+    ("wpml:payloadPositionIndex", "0"),  # 负载挂载位置
+    ("wpml:directoryName", "folder"),  # 新文件夹的名称
+])
+registerAction("GimbalPitch", "gimbalRotate", [  # 旋转云台
+    ("wpml:payloadPositionIndex", "0"),  # 负载挂载位置
+    ("wpml:gimbalHeadingYawBase", "north"),  # 云台偏航角转动坐标系
+    ("wpml:gimbalRotateMode", "absoluteAngle"),  # 云台转动模式
+    ("wpml:gimbalPitchRotateEnable", "1"),  # 是否使能云台Pitch转动
+    ("wpml:gimbalPitchRotateAngle", None),  # 云台Pitch转动角度
+    ("wpml:gimbalRollRotateEnable", "0"),  # 是否使能云台Roll转动
+    ("wpml:gimbalRollRotateAngle", "0"),  # 云台Roll转动角度
+    ("wpml:gimbalYawRotateEnable", "0"),  # 是否使能云台Yaw转动
+    ("wpml:gimbalYawRotateAngle", "0"),  # 云台Yaw转动角度
+    ("wpml:gimbalRotateTimeEnable", "0"),  # 是否使能云台转动时间
+    ("wpml:gimbalRotateTime", "0"),  # 云台完成转动用时
+])
+registerAction("AircraftYaw", "rotateYaw", [  # 飞行器偏航
+    ("wpml:aircraftHeading", None),  # 飞行器目标偏航角（相对于地理北）
+    ("wpml:aircraftPathMode", "counterClockwise"),  # 飞行器偏航角转动模式
+])
+registerAction("Hovering", "hover", [  # 悬停等待
+    ("wpml:hoverTime", None),  # 飞行器悬停等待时间，秒
+])
+registerAction("gimbalEvenlyRotate", "gimbalEvenlyRotate", [  # 航段间均匀转动云台pitch角
+    ("wpml:gimbalPitchRotateAngle", "0"),  # 云台Pitch转动角度
+    ("wpml:payloadPositionIndex", "0"),  # 负载挂载位置
+])
+registerAction("orientedShoot", "orientedShoot")  # 精准复拍动作
+registerAction("panoShot", "panoShot")  # 全景拍照动作（仅支持M30/M30T）
+registerAction("recordPointCloud", "recordPointCloud", [  # 点云录制操作
+    ("wpml:payloadPositionIndex", "0"),  # 负载挂载位置
+    ("wpml:recordPointCloudOperate", "startRecord"),  # 点云操作，startRecord：开始点云录制，pauseRecord：暂停点云录制，resumeRecord：继续点云录制，stopRecord：结束点云录制
+])
+
+UNKNOWN_ACTION = ("<wpml:actionActuatorFunc /><wpml:actionActuatorFuncParam />",) * 2  # 未注册的动作输出空节点
+
+
+class KmzCache:
+    # 磁盘缓存：以 kml 内容与转换配置的哈希为键保存 kmz，总大小超过 max_size 时淘汰最久未使用的
+    def __init__(self, directory, max_size=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, path, options):
+        # path 为 kml 文件路径或 kml 内容（bytes）
+        digest = hashlib.sha256(json.dumps(options, sort_keys=True).encode("utf-8"))
+        if isinstance(path, (bytes, bytearray)):
+            digest.update(path)
+            return digest.hexdigest()
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def get(self, key):
+        path = os.path.join(self.directory, key + ".kmz")
+        try:
+            with open(path, "rb") as file:
+                content = file.read()
+            os.utime(path)  # 更新访问顺序
+        except FileNotFoundError:
+            return None
+        return content
+
+    def put(self, key, content):
+        path = os.path.join(self.directory, key + ".kmz")
+        part = path + ".%d.part" % os.getpid()
+        with open(part, "wb") as file:
+            file.write(content)
+        os.replace(part, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".kmz"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class Mission:
+    # 紧凑的航点存储：经纬高、航向、速度为 array("d") 列，动作去重后按航点偏移索引
+    columns = ("lon", "lat", "alt", "heading", "speed")
 
-class ConvertKmz:
     def __init__(self):
+        self.lon = array("d")
+        self.lat = array("d")
+        self.alt = array("d")
+        self.heading = array("d")
+        self.speed = array("d")
+        self.action_table = []  # 去重后的 Action
+        self.action_index = array("l")  # 每个动作在 action_table 中的序号
+        self.action_offset = array("l", [0])  # 第 i 个航点的动作为 action_index[action_offset[i]:action_offset[i + 1]]
+        self._action_ids = {}
+
+    @classmethod
+    def load(cls, waypoints):
+        mission = cls()
+        for waypoint in waypoints:
+            mission.append(waypoint)
+        return mission
+
+    def append(self, waypoint):
+        self.lon.append(waypoint.lon)
+        self.lat.append(waypoint.lat)
+        self.alt.append(waypoint.alt)
+        self.heading.append(waypoint.heading)
+        self.speed.append(waypoint.speed)
+        for action in waypoint.actions:
+            if action not in self._action_ids:
+                self._action_ids[action] = len(self.action_table)
+                self.action_table.append(action)
+            self.action_index.append(self._action_ids[action])
+        self.action_offset.append(len(self.action_index))
+
+    def slice(self, start, end, first_actions=True):
+        # 连续的一段航点，返回新的 Mission，动作表共用；first_actions 为 False 时去掉首航点的动作
+        mission = Mission()
+        for name in self.columns:
+            setattr(mission, name, getattr(self, name)[start:end])
+        first = self.action_offset[start if first_actions else start + 1]
+        mission.action_index = self.action_index[first : self.action_offset[end]]
+        mission.action_offset = array("l", (max(offset - first, 0) for offset in self.action_offset[start : end + 1]))
+        mission.action_table = self.action_table
+        mission._action_ids = self._action_ids
+        return mission
+
+    def take(self, indices):
+        # 按序号选取航点，返回新的 Mission
+        mission = Mission()
+        for i in indices:
+            mission.append(self[i])
+        return mission
+
+    def actions(self, i):
+        table = self.action_table
+        return tuple(table[j] for j in self.action_index[self.action_offset[i] : self.action_offset[i + 1]])
+
+    def __len__(self):
+        return len(self.lon)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        return Waypoint(self.lon[i], self.lat[i], self.alt[i], self.heading[i], self.speed[i], self.actions(i))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def toNumpy(self):
+        # 以 numpy 数组形式返回各列（与 array 共享内存，不复制），需要安装 numpy
+        if numpy is None:
+            raise ImportError("需要安装 numpy")
+        return {name: numpy.frombuffer(getattr(self, name), dtype=numpy.float64) for name in self.columns}
+
+
+def segmentLengths(lon, lat, alt):
+    # 相邻航点间的距离，米：大圆距离与高度差合成；安装了 numpy 时整段向量化计算
+    if numpy is not None:
+        lon = numpy.radians(numpy.asarray(lon, dtype=numpy.float64))
+        lat = numpy.radians(numpy.asarray(lat, dtype=numpy.float64))
+        alt = numpy.asarray(alt, dtype=numpy.float64)
+        a = numpy.sin(numpy.diff(lat) / 2) ** 2 + numpy.cos(lat[:-1]) * numpy.cos(lat[1:]) * numpy.sin(numpy.diff(lon) / 2) ** 2
+        return numpy.hypot(2 * EARTH_RADIUS * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1.0))), numpy.diff(alt))
+    lengths = []
+    for i in range(1, len(lon)):
+        lat1, lat2 = math.radians(lat[i - 1]), math.radians(lat[i])
+        a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(math.radians(lon[i] - lon[i - 1]) / 2) ** 2
+        lengths.append(math.hypot(2 * EARTH_RADIUS * math.asin(math.sqrt(min(a, 1.0))), alt[i] - alt[i - 1]))
+    return lengths
+
+
+def simplifyMission(mission, tolerance):
+    # 三维 Douglas–Peucker：去除偏离航线不超过 tolerance（米）的航点
+    # 首末航点、带动作的航点以及航向变化前后的两个航点始终保留，偏航仍在原来的航段内完成
+    n = len(mission)
+    if n < 3:
+        return mission
+    keep = bytearray(n)
+    keep[0] = keep[n - 1] = 1
+    offset = mission.action_offset
+    heading = mission.heading
+    for i in range(1, n):
+        if offset[i] != offset[i + 1]:
+            keep[i] = 1
+        if heading[i] != heading[i - 1]:
+            keep[i] = keep[i - 1] = 1
+
+    # 以首航点为原点的局部平面坐标，米
+    scale = EARTH_RADIUS * math.pi / 180
+    lon0, lat0 = mission.lon[0], mission.lat[0]
+    cos0 = math.cos(math.radians(lat0))
+    if numpy is not None:
+        x = (numpy.frombuffer(mission.lon, dtype=numpy.float64) - lon0) * scale * cos0
+        y = (numpy.frombuffer(mission.lat, dtype=numpy.float64) - lat0) * scale
+        z = numpy.frombuffer(mission.alt, dtype=numpy.float64)
+    else:
+        x = [(lon - lon0) * scale * cos0 for lon in mission.lon]
+        y = [(lat - lat0) * scale for lat in mission.lat]
+        z = mission.alt
+
+    anchors = [i for i in range(n) if keep[i]]
+    stack = [(a, b) for a, b in zip(anchors, anchors[1:]) if b - a > 1]
+    while stack:
+        a, b = stack.pop()
+        i, distance = farthestPoint(x, y, z, a, b)
+        if distance > tolerance:
+            keep[i] = 1
+            if i - a > 1:
+                stack.append((a, i))
+            if b - i > 1:
+                stack.append((i, b))
+    if all(keep):
+        return mission
+    return mission.take(i for i in range(n) if keep[i])
+
+
+def farthestPoint(x, y, z, a, b):
+    # a、b 之间距离线段 ab 最远的航点及其距离
+    vx, vy, vz = x[b] - x[a], y[b] - y[a], z[b] - z[a]
+    vv = vx * vx + vy * vy + vz * vz
+    if numpy is not None:
+        wx, wy, wz = x[a + 1 : b] - x[a], y[a + 1 : b] - y[a], z[a + 1 : b] - z[a]
+        t = numpy.clip((wx * vx + wy * vy + wz * vz) / vv, 0.0, 1.0) if vv > 0 else 0.0
+        distances = numpy.sqrt((wx - t * vx) ** 2 + (wy - t * vy) ** 2 + (wz - t * vz) ** 2)
+        i = int(numpy.argmax(distances))
+        return a + 1 + i, float(distances[i])
+    best, farthest = a + 1, -1.0
+    for i in range(a + 1, b):
+        wx, wy, wz = x[i] - x[a], y[i] - y[a], z[i] - z[a]
+        t = min(max((wx * vx + wy * vy + wz * vz) / vv, 0.0), 1.0) if vv > 0 else 0.0
+        distance = math.sqrt((wx - t * vx) ** 2 + (wy - t * vy) ** 2 + (wz - t * vz) ** 2)
+        if distance > farthest:
+            best, farthest = i, distance
+    return best, farthest
+
+
+def splitMission(mission, max_waypoints=None, max_distance=None):
+    # 按每段航点数与航线长度（米）上限把航线拆成多段，每段从上一段的末航点开始，航段不会遗漏
+    # 大疆航线至少需要 2 个航点：长于 max_distance 的航段单独成为一段
+    # 衔接处的航点在上一段末尾已执行过动作，下一段中不再重复
+    if max_waypoints is not None and max_waypoints < 2:
+        raise ValueError("max_waypoints 至少为 2")
+    n = len(mission)
+    if max_distance:
+        lengths = segmentLengths(mission.lon, mission.lat, mission.alt)
+        if numpy is not None:
+            cumulative = numpy.concatenate(([0.0], numpy.cumsum(lengths)))
+        else:
+            cumulative = list(itertools.accumulate(lengths, initial=0.0))
+    if n <= 2:
+        return [mission]
+    waylines = []
+    start = 0
+    while True:
+        end = n
+        if max_waypoints:
+            end = min(end, start + max_waypoints)
+        if max_distance:
+            end = min(end, bisect.bisect_right(cumulative, cumulative[start] + max_distance))
+        end = min(max(end, start + 2), n)
+        waylines.append(mission.slice(start, end, first_actions=start == 0))
+        if end == n:
+            return waylines
+        start = end - 1
+
+
+def copyRange(source, target, size):
+    while size > 0:
+        chunk = source.read(min(size, 1024 * 1024))
+        if not chunk:
+            break
+        target.write(chunk)
+        size -= len(chunk)
+
+
+def hoverTime(actions):
+    # 航点悬停动作的总时间，秒
+    total = 0.0
+    for action in actions:
+        if action.action == "Hovering":
+            try:
+                seconds = float(action.param)
+            except ValueError:
+                continue
+            # 负数、nan、inf 等无效时间不计入
+            if math.isfinite(seconds) and seconds > 0:
+                total += seconds
+    return total
+
+
+class WaylineMeter:
+    # 累计航线长度与预计执行时间（长度 / autoFlightSpeed + 悬停时间）
+    # 航点按块缓存后向量化计算，内存占用不随航点数增长
+    block = 4096
+
+    def __init__(self, speed):
+        self.speed = speed
+        self.distance = 0.0
+        self.hover = 0.0
+        self.count = 0
+        self.lon = array("d")
+        self.lat = array("d")
+        self.alt = array("d")
+
+    @classmethod
+    def measure(cls, waypoints, speed):
+        meter = cls(speed)
+        if isinstance(waypoints, Mission):
+            # 整条航线一次计算
+            meter.lon, meter.lat, meter.alt = waypoints.lon, waypoints.lat, waypoints.alt
+            meter.count = len(waypoints)
+            meter.hover = hoverTime(waypoints.action_table[i] for i in waypoints.action_index)
+            meter.flush()
+        else:
+            for waypoint in waypoints:
+                meter.add(waypoint)
+        return meter
+
+    def add(self, waypoint):
+        self.lon.append(waypoint.lon)
+        self.lat.append(waypoint.lat)
+        self.alt.append(waypoint.alt)
+        self.count += 1
+        if waypoint.actions:
+            self.hover += hoverTime(waypoint.actions)
+        if len(self.lon) >= self.block:
+            self.flush()
+
+    def flush(self):
+        # 计算已缓存的航段，保留最后一个航点与下一块衔接
+        if len(self.lon) > 1:
+            self.distance += float(sum(segmentLengths(self.lon, self.lat, self.alt)))
+        self.lon = self.lon[-1:]
+        self.lat = self.lat[-1:]
+        self.alt = self.alt[-1:]
+
+    def result(self):
+        self.flush()
+        duration = (self.distance / self.speed if self.speed > 0 else 0.0) + self.hover
+        return {"waypoints": self.count, "distance": self.distance, "duration": duration}
+
+
+class ConvertKmz:
+    def __init__(
+        self, compact=False, cache=None, timestamp=None, simplify=None, instrument=False, hooks=(), max_waypoints=None, max_distance=None, split_files=False, jobs=None
+    ):
         super().__init__()
-        self.temp_path = "temp"
+        self.compact = compact  # 先将航点读入紧凑的 Mission 再写出，便于后续整体计算
+        self.simplify = simplify  # 航点简化容差（米），None 表示不简化
+        if max_waypoints is not None and max_waypoints < 2:
+            raise ValueError("max_waypoints 至少为 2")
+        self.max_waypoints = max_waypoints  # 每条航线的航点数上限（至少 2），超过时拆分为多条航线
+        self.max_distance = max_distance  # 每条航线的长度上限（米）
+        self.split_files = split_files  # 拆分后的每条航线单独生成一个 kmz，而不是写在同一个 kmz 中
+        self.jobs = jobs  # 拆分为多个 kmz 时的并行进程数，默认为 CPU 核数
+        self.files = None  # 拆分为多个 kmz 时实际生成的文件
+        self.cache = cache  # KmzCache，命中时直接返回之前生成的 kmz
+        self.timestamp = timestamp  # 固定的创建时间（Unix 毫秒），设置后相同输入生成完全相同的 kmz
+        self.instrument = instrument  # True：记录各阶段耗时、航点/动作数与输出大小；"memory"：另用 tracemalloc 记录峰值内存
+        self.hooks = list(hooks)  # 每个阶段结束时调用 hook(阶段名, 记录)，转换结束时调用 hook("total", stats)
+        self.stats = None
         self.conf = {
             "model": "M3T",
             "droneEnumValue": "77",
@@ -16,60 +483,382 @@ class ConvertKmz:
             "payloadPositionIndex": "0",
         }
 
-    def start(self, path):
-        self.data = self.getKmlData(path)
-        os.makedirs(self.temp_path + "/wpmz", exist_ok=True)
-        f1 = self.make("template.kml")
-        f2 = self.make("waylines.wpml")
-        shutil.make_archive("temp", "zip", self.temp_path, "wpmz")
-        shutil.move("temp.zip", self.getName(path) + ".kmz")
-        self.clearTemp()
-        return f1 or f2
-
-    def toDict(self, element):
-        res = {}
-        for child in element:
-            if child.tag == "Placemark":
-                if child.tag not in res:
-                    res[child.tag] = []
-                res[child.tag].append(self.toDict(child))
-            elif child.tag == "actions":
-                if child.tag not in res:
-                    res[child.tag] = []
-                res[child.tag].append(
-                    {
-                        "action": child.text,
-                        "label": child.attrib.get("label", ""),
-                        "param": child.attrib.get("param", ""),
-                        "targetMode": child.attrib.get("targetMode", ""),
-                    }
-                )
-            elif len(child) == 0:
-                res[child.tag] = child.text
+    def start(self, path, out=None):
+        # out 可以是文件路径或可写的文件对象，默认在当前目录生成同名 kmz
+        try:
+            self.convert(path, out or self.getName(path) + ".kmz")
+        except OSError as e:
+            # 只有写 kmz 失败返回状态；kml 不存在、无权限读取等错误与解析、数据错误一样直接抛出
+            if isinstance(path, (str, os.PathLike)) and e.filename == os.fspath(path):
+                raise
+            return "保存文件异常"
+        return False
+
+    def convert(self, path, out):
+        # 与 start 相同，但异常直接抛出；开启 instrument 或设置了 hooks 时返回统计信息，否则返回 None
+        # out 为路径时先写入临时文件再改名，失败时不会留下不完整的 kmz
+        tracing = self.resetStats()
+        started = time.perf_counter()
+        part = None if hasattr(out, "write") or self.split_files else out + ".%d.part" % os.getpid()
+        try:
+            if self.cache is not None and not self.split_files:
+                with self.phase("cache") as record:
+                    key = self.cache.key(path, self.cacheOptions())
+                    content = self.cache.get(key)
+                    record["hit"] = content is not None
+                if content is None:
+                    buffer = io.BytesIO()
+                    self.write(path, buffer)
+                    content = buffer.getvalue()
+                    self.cache.put(key, content)
+                with self.phase("save") as record:
+                    self.save(content, part or out)
+                    record["output_bytes"] = len(content)
             else:
-                res[child.tag] = self.toDict(child)
-        return res
-
-    def getKmlData(self, path):
-        tree = ET.parse(path)
-        root = tree.getroot()
-        for element in root.iter():
-            if "}" in element.tag:
-                element.tag = element.tag.split("}", 1)[1]
-        json_dict = self.toDict(root)
-        return json_dict
-
-    def make(self, file):
-        status = False
-        is_template = file == "template.kml"
+                self.write(path, part or out)
+            if part is not None:
+                os.replace(part, out)
+        except Exception:
+            if part is not None and os.path.exists(part):
+                os.remove(part)
+            raise
+        finally:
+            if tracing:
+                tracemalloc.stop()
+        if self.stats is not None:
+            self.stats["seconds"] = time.perf_counter() - started
+            for hook in self.hooks:
+                hook("total", self.stats)
+        return self.stats
+
+    def resetStats(self):
+        # 开始新的统计，需要记录内存且 tracemalloc 尚未启动时启动它，返回是否由此处启动
+        self.stats = {"phases": {}} if self.instrument or self.hooks else None
+        if self.instrument == "memory" and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            return True
+        return False
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        # 记录一个阶段的耗时与峰值内存；record 中的 excluded 为需要扣除的、已单独统计的耗时
+        record = {}
+        if self.stats is None:
+            yield record
+            return
+        if self.instrument == "memory":
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        yield record
+        record["seconds"] = time.perf_counter() - started - record.pop("excluded", 0.0)
+        if self.instrument == "memory":
+            record["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        self.endPhase(name, record)
+
+    def endPhase(self, name, record):
+        self.stats["phases"][name] = record
+        for hook in self.hooks:
+            hook(name, record)
+
+    def timedParse(self, waypoints):
+        # 流式读取时解析与写出交替进行，单独累计解析耗时
+        record = {"seconds": 0.0, "waypoints": 0}
+        iterator = iter(waypoints)
+        while True:
+            started = time.perf_counter()
+            try:
+                waypoint = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                record["seconds"] += time.perf_counter() - started
+            record["waypoints"] += 1
+            yield waypoint
+        if self.instrument == "memory":
+            # 解析与写出交替进行、无法分开统计，峰值内存为两者合计（write 阶段开始以来的峰值）
+            record["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        self.endPhase("parse", record)
+
+    def cacheOptions(self):
+        # 影响输出内容的配置，作为缓存键的一部分
+        return {
+            "version": CACHE_VERSION,
+            "conf": self.conf,
+            "timestamp": self.timestamp,
+            "simplify": self.simplify,
+            "max_waypoints": self.max_waypoints,
+            "max_distance": self.max_distance,
+            "actions": ACTIONS,  # 序列化后的动作模板，重新注册同名动作时缓存键随之变化
+        }
+
+    def write(self, path, out):
+        if self.split_files and hasattr(out, "write"):
+            raise ValueError("拆分为多个 kmz 时 out 必须是文件路径")
+        waylines = self.split(self.load(path))
+        with self.phase("write") as record:
+            if self.split_files:
+                record.update(self.writeFiles(waylines, out))
+            else:
+                record.update(self.writeWaylines(waylines, out))
+            if self.stats is not None and not isinstance(waylines[0], Mission):
+                record["excluded"] = self.stats["phases"]["parse"]["seconds"]
+
+    def load(self, path):
+        # 读取航线信息，返回航点（流式迭代器或 Mission）
+        with self.phase("info"):
+            self.info = self.getKmlInfo(path)
+        waypoints = self.iterKmlWaypoints(path)
+        if self.compact or self.simplify is not None or self.max_waypoints or self.max_distance:
+            with self.phase("parse") as record:
+                waypoints = Mission.load(waypoints)
+                record["waypoints"] = len(waypoints)
+        elif self.stats is not None:
+            waypoints = self.timedParse(waypoints)
+        if self.simplify is not None:
+            # 序号与动作组 id 在写出时按顺序重新编号
+            with self.phase("simplify") as record:
+                waypoints = simplifyMission(waypoints, self.simplify)
+                record["waypoints"] = len(waypoints)
+        return waypoints
+
+    def split(self, waypoints):
+        # 按 max_waypoints / max_distance 拆分为多段航线，未设置时整体作为一段
+        if not (self.max_waypoints or self.max_distance):
+            return [waypoints]
+        with self.phase("split") as record:
+            waylines = splitMission(waypoints, self.max_waypoints, self.max_distance)
+            record["waylines"] = len(waylines)
+        return waylines
+
+    def measure(self, path):
+        # 只计算航点数、航线长度（米）与预计执行时间（秒），不生成 kmz
+        tracing = self.resetStats()
+        try:
+            waypoints = self.load(path)
+            with self.phase("measure"):
+                result = WaylineMeter.measure(waypoints, self.info["autoFlightSpeed"]).result()
+                if self.max_waypoints or self.max_distance:
+                    result["waylines"] = [WaylineMeter.measure(wayline, self.info["autoFlightSpeed"]).result() for wayline in self.split(waypoints)]
+        finally:
+            if tracing:
+                tracemalloc.stop()
+        return dict(self.info, **result)
+
+    def build(self, path):
+        # 在内存中组装 kmz，返回 bytes；path 也可以是 kml 内容（bytes）
+        buffer = io.BytesIO()
+        self.convert(path, buffer)
+        return buffer.getvalue()
+
+    def save(self, content, out):
+        if hasattr(out, "write"):
+            out.write(content)
+        else:
+            with open(out, "wb") as file:
+                file.write(content)
+
+    def iterKml(self, path, tags):
+        # 流式解析，返回 (标签, 节点, 父节点)，处理完的节点会从父节点移除，内存占用不随航点数增长
+        # path 也可以是 kml 内容（bytes）
+        if isinstance(path, (bytes, bytearray)):
+            path = io.BytesIO(path)
+        stack = []
+        for event, element in ET.iterparse(path, events=("start", "end")):
+            if event == "start":
+                stack.append(element)
+                continue
+            stack.pop()
+            tag = localName(element.tag)
+            if tag in tags:
+                parent = stack[-1] if stack else None
+                yield tag, element, parent
+                if parent is not None:
+                    parent.remove(element)
+
+    def getKmlInfo(self, path):
+        # 航线名称与速度，速度位于航点之后的 Wayline Placemark 中，需要单独扫描一遍
+        info = {"name": "", "autoFlightSpeed": None}
+        for tag, element, parent in self.iterKml(path, ("name", "autoFlightSpeed", "Placemark")):
+            if tag == "name" and parent is not None and localName(parent.tag) == "Document":
+                info["name"] = element.text or ""
+            elif tag == "autoFlightSpeed" and info["autoFlightSpeed"] is None:
+                info["autoFlightSpeed"] = float(element.text)
+        if info["autoFlightSpeed"] is None:
+            raise ValueError("kml 中缺少 autoFlightSpeed")
+        return info
+
+    def iterKmlWaypoints(self, path):
+        # 只有 Document/Folder 下的 Placemark 是航点，Document 下的起飞点等 Placemark 不计入
+        for tag, element, parent in self.iterKml(path, ("Placemark",)):
+            if parent is None or localName(parent.tag) != "Folder":
+                continue
+            waypoint = self.toWaypoint(element)
+            if waypoint is not None:
+                yield waypoint
+
+    def toWaypoint(self, placemark):
+        coordinates = None
+        heading = 0.0
+        speed = 0.0  # 0 表示使用全局速度
+        actions = []
+        for child in placemark:
+            tag = localName(child.tag)
+            if tag == "Point":
+                for item in child:
+                    if localName(item.tag) == "coordinates":
+                        coordinates = item.text.strip().split(",")
+            elif tag == "ExtendedData":
+                for item in child:
+                    name = localName(item.tag)
+                    if name == "heading":
+                        heading = float(item.text)
+                    elif name == "speed":
+                        speed = float(item.text)
+                    elif name == "actions":
+                        actions.append(
+                            Action(
+                                (item.text or "").strip(),
+                                item.attrib.get("label", ""),
+                                item.attrib.get("param", ""),
+                                item.attrib.get("targetMode", ""),
+                            )
+                        )
+        if coordinates is None:
+            # 航线 LineString 等非航点 Placemark
+            return None
+        return Waypoint(float(coordinates[0]), float(coordinates[1]), float(coordinates[2]), heading, speed, tuple(actions))
+
+    def writeKmz(self, waypoints, out):
+        return self.writeWaylines([waypoints], out)
+
+    def writeWaylines(self, waylines, out):
+        # 逐航点填入 makeFormats 的格式串并直接写入 zip，内存占用不随航点数增长；返回航点数、动作数与输出大小
+        # waylines 中每一段航点写为一个 Folder（templateId/waylineId 依次递增），航点序号与动作组 id 在每段内从 0 开始
+        # zip 同一时间只能写一个条目，waylines.wpml 先写入临时文件（超过 SPOOL_SIZE 转存磁盘），最后再拷入
+        # waylines.wpml 的航线长度与预计时间在遍历航点时累计，文件头最后生成
+        template_head, _, _, template_tail = self.makeFrame(True)
+        template_plain, template_grouped, template_action = self.makeFormats(True)
+        waylines_plain, waylines_grouped, waylines_action = self.makeFormats(False)
+        action_xml = {}  # Action -> makeAction 的结果，相同的动作只生成一次
+        speed = formatNumber(self.info["autoFlightSpeed"])
+        meters = []
+        _waypoints = 0
+        _actions = 0
+        with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as kmz, tempfile.SpooledTemporaryFile(SPOOL_SIZE) as spool:
+            kmz.writestr(self.zipInfo("wpmz/"), b"")
+            with kmz.open(self.zipInfo("wpmz/template.kml"), "w") as template:
+                template.write(template_head)
+                for wayline_id, waypoints in enumerate(waylines):
+                    _, folder_head, folder_tail, _ = self.makeFrame(True, wayline_id=wayline_id)
+                    template.write(folder_head)
+                    meter = WaylineMeter(self.info["autoFlightSpeed"])
+                    _actionGroupId = 0
+                    _index = 0
+                    for Placemark_item in waypoints:
+                        point = {
+                            "coordinates": formatNumber(Placemark_item.lon) + "," + formatNumber(Placemark_item.lat),
+                            "altitude": formatNumber(Placemark_item.alt),
+                            "heading": formatNumber(Placemark_item.heading),
+                            "speed": speed,
+                            "index": _index,
+                            "actionGroupId": _actionGroupId,
+                        }
+                        if Placemark_item.actions:
+                            actions = []
+                            for actions_item in Placemark_item.actions:
+                                xml = action_xml.get(actions_item)
+                                if xml is None:
+                                    xml = action_xml[actions_item] = self.makeAction(actions_item)
+                                actions.append(xml)
+                            template_actions = "".join(template_action.format(actionId=0, action=xml) for xml in actions)
+                            waylines_actions = "".join(waylines_action.format(actionId=i, action=xml) for i, xml in enumerate(actions))
+                            template.write(template_grouped.format(actions=template_actions, **point).encode("utf-8"))
+                            spool.write(waylines_grouped.format(actions=waylines_actions, **point).encode("utf-8"))
+                            _actions += len(actions)
+                            _actionGroupId += 1
+                        else:
+                            template.write(template_plain.format(**point).encode("utf-8"))
+                            spool.write(waylines_plain.format(**point).encode("utf-8"))
+                        meter.add(Placemark_item)
+                        _index += 1
+                    template.write(folder_tail)
+                    meters.append((meter, spool.tell()))
+                    _waypoints += _index
+                template.write(template_tail)
+            spool.seek(0)
+            with kmz.open(self.zipInfo("wpmz/waylines.wpml"), "w") as waylines_file:
+                start = 0
+                for wayline_id, (meter, end) in enumerate(meters):
+                    waylines_head, folder_head, folder_tail, waylines_tail = self.makeFrame(False, meter, wayline_id)
+                    if wayline_id == 0:
+                        waylines_file.write(waylines_head)
+                    waylines_file.write(folder_head)
+                    copyRange(spool, waylines_file, end - start)
+                    waylines_file.write(folder_tail)
+                    start = end
+                waylines_file.write(waylines_tail)
+            entries = kmz.infolist()
+        return {
+            "waylines": len(meters),
+            "waypoints": _waypoints,
+            "actions": _actions,
+            "template_bytes": entries[1].file_size,
+            "waylines_bytes": entries[2].file_size,
+            "compressed_bytes": sum(entry.compress_size for entry in entries),
+        }
+
+    def writeFiles(self, waylines, out):
+        # 每段航线各生成一个 kmz：out 为 a.kmz 时依次为 a_1.kmz、a_2.kmz……，多段时在进程池中并行写出
+        self.files = [splitName(out, i + 1) for i in range(len(waylines))]
+        tasks = [(self.conf, self.timestamp, self.info, wayline, file) for wayline, file in zip(waylines, self.files)]
+        jobs = min(self.jobs or os.cpu_count() or 1, len(tasks))
+        if jobs > 1:
+            with ProcessPoolExecutor(jobs) as executor:
+                results = list(executor.map(writeChunk, *zip(*tasks)))
+        else:
+            results = [writeChunk(*task) for task in tasks]
+        return {
+            "waylines": len(results),
+            "waypoints": sum(result["waypoints"] for result in results),
+            "actions": sum(result["actions"] for result in results),
+            "compressed_bytes": sum(result["compressed_bytes"] for result in results),
+            "files": self.files,
+        }
+
+    def zipInfo(self, name):
+        # 设置了 timestamp 时 zip 中的文件时间也固定（按 UTC，zip 不支持 1980 年以前的时间）
+        if self.timestamp is not None:
+            date_time = max(time.gmtime(self.timestamp / 1000)[:6], (1980, 1, 1, 0, 0, 0))
+        else:
+            date_time = time.localtime()[:6]
+        info = zipfile.ZipInfo(name, date_time)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        return info
+
+    def makeFrame(self, is_template, meter=None, wayline_id=0):
+        # 文件与 Folder 除航点外的部分：(文件头, Folder 头, Folder 尾, 文件尾)，航点逐个写在 Folder 头尾之间
+        kml, Folder = self.makeHead(is_template, meter, wayline_id)
+        ET.SubElement(Folder, "placemarks")
+        self.makeTail(Folder, is_template)
+        head, tail = ET.tostring(kml, encoding="unicode").split("<placemarks />")
+        head, folder_head = head.split("<Folder>")
+        folder_tail, tail = tail.split("</Folder>")
+        return (
+            ('<?xml version="1.0" encoding="UTF-8"?>' + head).encode("utf-8"),
+            ("<Folder>" + folder_head).encode("utf-8"),
+            (folder_tail + "</Folder>").encode("utf-8"),
+            tail.encode("utf-8"),
+        )
+
+    def makeHead(self, is_template, meter=None, wayline_id=0):
         namespace = {"xmlns": "http://www.opengis.net/kml/2.2", "xmlns:wpml": "http://www.dji.com/wpmz/1.0.6"}
         kml = ET.Element("kml", namespace)
         Document = ET.SubElement(kml, "Document")
 
         if is_template:
             author = ET.SubElement(Document, "wpml:author")
-            author.text = self.data["Document"]["name"]  # 文件创建作者，可选
-            now = str(int(time.time() * 1000))
+            author.text = self.info["name"]  # 文件创建作者，可选
+            now = str(int(self.timestamp if self.timestamp is not None else time.time() * 1000))
             createTime = ET.SubElement(Document, "wpml:createTime")
             createTime.text = now  # 文件创建时间（Unix Timestamp），可选
             updateTime = ET.SubElement(Document, "wpml:updateTime")
@@ -85,7 +874,7 @@ class ConvertKmz:
         executeRCLostAction = ET.SubElement(missionConfig, "wpml:executeRCLostAction")
         executeRCLostAction.text = "goBack"  # 失控动作类型，goBack：返航。飞行器从失控位置飞向起飞点；landing：降落。飞行器从失控位置原地降落；hover：悬停。飞行器从失控位置悬停
         globalTransitionalSpeed = ET.SubElement(missionConfig, "wpml:globalTransitionalSpeed")
-        globalTransitionalSpeed.text = self.data["Document"]["Placemark"][0]["ExtendedData"]["autoFlightSpeed"]  # 全局航线过渡速度
+        globalTransitionalSpeed.text = formatNumber(self.info["autoFlightSpeed"])  # 全局航线过渡速度
         droneInfo = ET.SubElement(missionConfig, "wpml:droneInfo")
         droneEnumValue = ET.SubElement(droneInfo, "wpml:droneEnumValue")
         droneEnumValue.text = self.conf["droneEnumValue"]  # 飞行器机型主类型
@@ -104,7 +893,7 @@ class ConvertKmz:
             templateType = ET.SubElement(Folder, "wpml:templateType")
             templateType.text = "waypoint"  # 预定义模板类型，waypoint：航点飞行；mapping2d：建图航拍；mapping3d：倾斜摄影；mappingStrip：航带飞行
         templateId = ET.SubElement(Folder, "wpml:templateId")
-        templateId.text = "0"  # 模板ID
+        templateId.text = str(wayline_id)  # 模板ID
         if is_template:
             waylineCoordinateSysParam = ET.SubElement(Folder, "wpml:waylineCoordinateSysParam")
             coordinateMode = ET.SubElement(waylineCoordinateSysParam, "wpml:coordinateMode")
@@ -117,11 +906,12 @@ class ConvertKmz:
             executeHeightMode = ET.SubElement(Folder, "wpml:executeHeightMode")
             executeHeightMode.text = "WGS84"  # 执行高度模式
             waylineId = ET.SubElement(Folder, "wpml:waylineId")
-            waylineId.text = "0"  # 航线ID
+            waylineId.text = str(wayline_id)  # 航线ID
+            stats = meter.result() if meter else {"distance": 0, "duration": 0}
             distance = ET.SubElement(Folder, "wpml:distance")
-            distance.text = "0"  # 航线长度
+            distance.text = formatNumber(round(stats["distance"], 2))  # 航线长度，米
             duration = ET.SubElement(Folder, "wpml:duration")
-            duration.text = "0"  # 预计执行时间
+            duration.text = formatNumber(round(stats["duration"], 2))  # 预计执行时间，秒
         autoFlightSpeed = ET.SubElement(Folder, "wpml:autoFlightSpeed")
         autoFlightSpeed.text = globalTransitionalSpeed.text  # 全局航线飞行速度
         if is_template:
@@ -144,230 +934,397 @@ class ConvertKmz:
             globalWaypointTurnMode.text = "toPointAndStopWithDiscontinuityCurvature"  # 全局航点类型（全局航点转弯模式）
             globalUseStraightLine = ET.SubElement(Folder, "wpml:globalUseStraightLine")
             globalUseStraightLine.text = "1"  # 全局航段轨迹是否尽量贴合直线
+        return kml, Folder
 
-        _actionGroupId = 0
-        _index = 0
-        for Placemark_item in self.data["Document"]["Folder"]["Placemark"]:
-            # for
-            Placemark = ET.SubElement(Folder, "Placemark")
-            Point = ET.SubElement(Placemark, "Point")
-            coordinates = ET.SubElement(Point, "coordinates")
-            coordinates_arr = Placemark_item["Point"]["coordinates"].split(",")
-            coordinates.text = coordinates_arr[0] + "," + coordinates_arr[1]  # 航点经纬度<纬度,经度>
-            index = ET.SubElement(Placemark, "wpml:index")
-            index.text = str(_index)  # 航点序号
-            _index += 1
-            if is_template:
-                ellipsoidHeight = ET.SubElement(Placemark, "wpml:ellipsoidHeight")
-                ellipsoidHeight.text = coordinates_arr[2]  # 全局航线高度（椭球高）
-                height = ET.SubElement(Placemark, "wpml:height")
-                height.text = coordinates_arr[2]  # 全局航线高度（EGM96海拔高/相对起飞点高度/AGL相对地面高度）
-            else:
-                executeHeight = ET.SubElement(Placemark, "wpml:executeHeight")
-                executeHeight.text = coordinates_arr[2]  # 航点执行高度
-                waypointSpeed = ET.SubElement(Placemark, "wpml:waypointSpeed")
-                waypointSpeed.text = globalTransitionalSpeed.text  # 航点飞行速度，当前航点飞向下一个航点的速度
-            waypointHeadingParam = ET.SubElement(Placemark, "wpml:waypointHeadingParam")
-            waypointHeadingMode = ET.SubElement(waypointHeadingParam, "wpml:waypointHeadingMode")
-            waypointHeadingMode.text = "smoothTransition"  # 飞行器偏航角模式
-            waypointHeadingAngle = ET.SubElement(waypointHeadingParam, "wpml:waypointHeadingAngle")
-            waypointHeadingAngle.text = Placemark_item["ExtendedData"]["heading"] if "heading" in Placemark_item["ExtendedData"] else "0"  # 飞行器偏航角度
-            waypointPoiPoint = ET.SubElement(waypointHeadingParam, "wpml:waypointPoiPoint")
-            waypointPoiPoint.text = "0.000000,0.000000,0.000000"  # 兴趣点
-            if not is_template:
-                waypointHeadingAngleEnable = ET.SubElement(waypointHeadingParam, "wpml:waypointHeadingAngleEnable")
-                waypointHeadingAngleEnable.text = "1"  # 未知
-            waypointHeadingPathMode = ET.SubElement(waypointHeadingParam, "wpml:waypointHeadingPathMode")
-            waypointHeadingPathMode.text = "followBadArc"  # 飞行器偏航角转动方向
-            waypointHeadingPoiIndex = ET.SubElement(waypointHeadingParam, "wpml:waypointHeadingPoiIndex")
-            waypointHeadingPoiIndex.text = "0"  # 未知
-            if is_template:
-                useGlobalSpeed = ET.SubElement(Placemark, "wpml:useGlobalSpeed")
-                useGlobalSpeed.text = "1"  # 是否使用全局飞行速度
-                useGlobalTurnParam = ET.SubElement(Placemark, "wpml:useGlobalTurnParam")
-                useGlobalTurnParam.text = "1"  # 是否使用全局航点类型（全局航点转弯模式）
-            else:
-                waypointTurnParam = ET.SubElement(Placemark, "wpml:waypointTurnParam")
-                waypointTurnMode = ET.SubElement(waypointTurnParam, "wpml:waypointTurnMode")
-                waypointTurnMode.text = "toPointAndStopWithDiscontinuityCurvature"  # 航点类型
-                waypointTurnDampingDist = ET.SubElement(waypointTurnParam, "wpml:waypointTurnDampingDist")
-                waypointTurnDampingDist.text = "0"  # 航点转弯截距
-            useStraightLine = ET.SubElement(Placemark, "wpml:useStraightLine")
-            if is_template:
-                useStraightLine.text = "0"  # 该航段是否贴合直线
-            else:
-                useStraightLine.text = "1"
-            if "actions" in Placemark_item["ExtendedData"]:
-                actionGroup = ET.SubElement(Placemark, "wpml:actionGroup")
-                actionGroupId = ET.SubElement(actionGroup, "wpml:actionGroupId")
-                actionGroupId.text = str(_actionGroupId)  # 动作组id
-                actionGroupStartIndex = ET.SubElement(actionGroup, "wpml:actionGroupStartIndex")
-                actionGroupStartIndex.text = str(_actionGroupId + 1)  # 动作组开始生效的航点
-                actionGroupEndIndex = ET.SubElement(actionGroup, "wpml:actionGroupEndIndex")
-                actionGroupEndIndex.text = actionGroupStartIndex.text  # 动作组结束生效的航点
-                actionGroupMode = ET.SubElement(actionGroup, "wpml:actionGroupMode")
-                actionGroupMode.text = "sequence"  # 动作执行模式
-                actionTrigger = ET.SubElement(actionGroup, "wpml:actionTrigger")
-                actionTriggerType = ET.SubElement(actionTrigger, "wpml:actionTriggerType")
-                actionTriggerType.text = "reachPoint"  # 动作触发器类型
-                _actionGroupId += 1
-
-                _actionId = 0
-                for actions_item in Placemark_item["ExtendedData"]["actions"]:
-                    # while
-                    action = ET.SubElement(actionGroup, "wpml:action")
-                    actionId = ET.SubElement(action, "wpml:actionId")
-                    if is_template:
-                        actionId.text = "0"  # 动作id
-                    else:
-                        actionId.text = str(_actionId)
-                        _actionId += 1
-                    actionActuatorFunc = ET.SubElement(action, "wpml:actionActuatorFunc")  # 动作类型
-                    actionActuatorFuncParam = ET.SubElement(action, "wpml:actionActuatorFuncParam")
-                    if actions_item["action"] == "ShootPhoto":
-                        actionActuatorFunc.text = "takePhoto"  # 单拍
-                        payloadPositionIndex = ET.SubElement(actionActuatorFuncParam, "wpml:payloadPositionIndex")
-                        payloadPositionIndex.text = "0"  # 负载挂载位置
-                        fileSuffix = ET.SubElement(actionActuatorFuncParam, "wpml:fileSuffix")
-                        fileSuffix.text = ""  # 拍摄照片文件后缀
-                        # payloadLensIndex = ET.SubElement(actionActuatorFuncParam, "wpml:payloadLensIndex")
-                        # payloadLensIndex.text = "1" #拍摄照片存储类型
-                        useGlobalPayloadLensIndex = ET.SubElement(actionActuatorFuncParam, "wpml:useGlobalPayloadLensIndex")
-                        useGlobalPayloadLensIndex.text = "1"  # 是否使用全局存储类型
-                    elif actions_item["action"] == "StartRecording":
-                        actionActuatorFunc.text = "startRecord"  # 开始录像
-                        payloadPositionIndex = ET.SubElement(actionActuatorFuncParam, "wpml:payloadPositionIndex")
-                        payloadPositionIndex.text = "0"  # 负载挂载位置
-                        fileSuffix = ET.SubElement(actionActuatorFuncParam, "wpml:fileSuffix")
-                        fileSuffix.text = ""  # 拍摄照片文件后缀
-                        # payloadLensIndex = ET.SubElement(actionActuatorFuncParam, "wpml:payloadLensIndex")
-                        # payloadLensIndex.text = "1" #视频存储类型
-                        useGlobalPayloadLensIndex = ET.SubElement(actionActuatorFuncParam, "wpml:useGlobalPayloadLensIndex")
-                        useGlobalPayloadLensIndex.text = "1"  # 是否使用全局存储类型
-                    elif actions_item["action"] == "StopRecording":
-                        actionActuatorFunc.text = "stopRecord"  # 结束录像
-                        payloadPositionIndex = ET.SubElement(actionActuatorFuncParam, "wpml:payloadPositionIndex")
-                        payloadPositionIndex.text = "0"  # 负载挂载位置
-                        payloadLensIndex = ET.SubElement(actionActuatorFuncParam, "wpml:payloadLensIndex")
-                        payloadLensIndex.text = "zoom"  # 视频存储类型
-                    elif actions_item["action"] == "focus":
-                        actionActuatorFunc.text = "focus"  # 对焦
-                        payloadPositionIndex = ET.SubElement(actionActuatorFuncParam, "wpml:payloadPositionIndex")
-                        payloadPositionIndex.text = "0"  # 负载挂载位置
-                        isPointFocus = ET.SubElement(actionActuatorFuncParam, "wpml:isPointFocus")
-                        isPointFocus.text = "0"  # 是否点对焦
-                        focusX = ET.SubElement(actionActuatorFuncParam, "wpml:focusX")
-                        focusX.text = "0.5"  # 对焦点位置
-                        focusY = ET.SubElement(actionActuatorFuncParam, "wpml:focusY")
-                        focusY.text = "0.5"  # 对焦点位置
-                        focusRegionWidth = ET.SubElement(actionActuatorFuncParam, "wpml:focusRegionWidth")
-                        focusRegionWidth.text = "0"  # 对焦区域宽度比
-                        focusRegionHeight = ET.SubElement(actionActuatorFuncParam, "wpml:focusRegionHeight")
-                        focusRegionHeight.text = "0"  # 对焦区域高度比
-                        isInfiniteFocus = ET.SubElement(actionActuatorFuncParam, "wpml:isInfiniteFocus")
-                        isInfiniteFocus.text = "0"  # 是否无穷远对焦
-                    elif actions_item["action"] == "zoom":
-                        actionActuatorFunc.text = "zoom"  # 变焦
-                        payloadPositionIndex = ET.SubElement(actionActuatorFuncParam, "wpml:payloadPositionIndex")
-                        payloadPositionIndex.text = "0"  # 负载挂载位置
-                        focalLength = ET.SubElement(actionActuatorFuncParam, "wpml:focalLength")
-                        focalLength.text = "50"  # 变焦焦距
-                    elif actions_item["action"] == "customDirName":
-                        actionActuatorFunc.text = "customDirName"  # 创建新文件夹
-                        payloadPositionIndex = ET.SubElement(actionActuatorFuncParam, "wpml:payloadPositionIndex")
-                        payloadPositionIndex.text = "0"  # 负载挂载位置
-                        directoryName = ET.SubElement(actionActuatorFuncParam, "wpml:directoryName")
-                        directoryName.text = "folder"  # 新文件夹的名称
-                    elif actions_item["action"] == "GimbalPitch":
-                        actionActuatorFunc.text = "gimbalRotate"  # 旋转云台
-                        payloadPositionIndex = ET.SubElement(actionActuatorFuncParam, "wpml:payloadPositionIndex")
-                        payloadPositionIndex.text = "0"  # 负载挂载位置
-                        gimbalHeadingYawBase = ET.SubElement(actionActuatorFuncParam, "wpml:gimbalHeadingYawBase")
-                        gimbalHeadingYawBase.text = "north"  # 云台偏航角转动坐标系
-                        gimbalRotateMode = ET.SubElement(actionActuatorFuncParam, "wpml:gimbalRotateMode")
-                        gimbalRotateMode.text = "absoluteAngle"  # 云台转动模式
-                        gimbalPitchRotateEnable = ET.SubElement(actionActuatorFuncParam, "wpml:gimbalPitchRotateEnable")
-                        gimbalPitchRotateEnable.text = "1"  # 是否使能云台Pitch转动
-                        gimbalPitchRotateAngle = ET.SubElement(actionActuatorFuncParam, "wpml:gimbalPitchRotateAngle")
-                        gimbalPitchRotateAngle.text = actions_item["param"]  # 云台Pitch转动角度
-                        gimbalRollRotateEnable = ET.SubElement(actionActuatorFuncParam, "wpml:gimbalRollRotateEnable")
-                        gimbalRollRotateEnable.text = "0"  # 是否使能云台Roll转动
-                        gimbalRollRotateAngle = ET.SubElement(actionActuatorFuncParam, "wpml:gimbalRollRotateAngle")
-                        gimbalRollRotateAngle.text = "0"  # 云台Roll转动角度
-                        gimbalYawRotateEnable = ET.SubElement(actionActuatorFuncParam, "wpml:gimbalYawRotateEnable")
-                        gimbalYawRotateEnable.text = "0"  # 是否使能云台Yaw转动
-                        gimbalYawRotateAngle = ET.SubElement(actionActuatorFuncParam, "wpml:gimbalYawRotateAngle")
-                        gimbalYawRotateAngle.text = "0"  # 云台Yaw转动角度
-                        gimbalRotateTimeEnable = ET.SubElement(actionActuatorFuncParam, "wpml:gimbalRotateTimeEnable")
-                        gimbalRotateTimeEnable.text = "0"  # 是否使能云台转动时间
-                        gimbalRotateTime = ET.SubElement(actionActuatorFuncParam, "wpml:gimbalRotateTime")
-                        gimbalRotateTime.text = "0"  # 云台完成转动用时
-                    elif actions_item["action"] == "AircraftYaw":
-                        actionActuatorFunc.text = "rotateYaw"  # 飞行器偏航
-                        aircraftHeading = ET.SubElement(actionActuatorFuncParam, "wpml:aircraftHeading")
-                        aircraftHeading.text = actions_item["param"]  # 飞行器目标偏航角（相对于地理北）
-                        aircraftPathMode = ET.SubElement(actionActuatorFuncParam, "wpml:aircraftPathMode")
-                        aircraftPathMode.text = "counterClockwise"  # 飞行器偏航角转动模式
-                    elif actions_item["action"] == "Hovering":
-                        actionActuatorFunc.text = "hover"  # 悬停等待
-                        hoverTime = ET.SubElement(actionActuatorFuncParam, "wpml:hoverTime")
-                        hoverTime.text = actions_item["param"]  # 飞行器悬停等待时间，秒
-                    elif actions_item["action"] == "gimbalEvenlyRotate":
-                        actionActuatorFunc.text = "gimbalEvenlyRotate"  # 航段间均匀转动云台pitch角
-                        gimbalPitchRotateAngle = ET.SubElement(actionActuatorFuncParam, "wpml:gimbalPitchRotateAngle")
-                        gimbalPitchRotateAngle.text = "0"  # 云台Pitch转动角度
-                        payloadPositionIndex = ET.SubElement(actionActuatorFuncParam, "wpml:payloadPositionIndex")
-                        payloadPositionIndex.text = "0"  # 负载挂载位置
-                    elif actions_item["action"] == "orientedShoot":
-                        actionActuatorFunc.text = "orientedShoot"  # 精准复拍动作
-                    elif actions_item["action"] == "panoShot":
-                        actionActuatorFunc.text = "panoShot"  # 全景拍照动作（仅支持M30/M30T）
-                    elif actions_item["action"] == "recordPointCloud":
-                        actionActuatorFunc.text = "recordPointCloud"  # 点云录制操作
-                        payloadPositionIndex = ET.SubElement(actionActuatorFuncParam, "wpml:payloadPositionIndex")
-                        payloadPositionIndex.text = "0"  # 负载挂载位置
-                        recordPointCloudOperate = ET.SubElement(actionActuatorFuncParam, "wpml:recordPointCloudOperate")
-                        recordPointCloudOperate.text = "startRecord"  # 点云操作，startRecord：开始点云录制，pauseRecord：暂停点云录制，resumeRecord：继续点云录制，stopRecord：结束点云录制
-
-            if not is_template:
-                waypointGimbalHeadingParam = ET.SubElement(Placemark, "wpml:waypointGimbalHeadingParam")
-                waypointGimbalPitchAngle = ET.SubElement(waypointGimbalHeadingParam, "wpml:waypointGimbalPitchAngle")
-                waypointGimbalPitchAngle.text = "0"  # 未知
-                waypointGimbalYawAngle = ET.SubElement(waypointGimbalHeadingParam, "wpml:waypointGimbalYawAngle")
-                waypointGimbalYawAngle.text = "0"  # 未知
-            isRisky = ET.SubElement(Placemark, "wpml:isRisky")
-            isRisky.text = "0"  # 是否危险点
-            if not is_template:
-                waypointWorkType = ET.SubElement(Placemark, "wpml:waypointWorkType")
-                waypointWorkType.text = "0"  # 未知
-            # end for
+    def makePlacemark(self, point, is_template):
+        # point 中为各字段的文本，actions 为 None 时没有动作组，否则为动作组中各动作的 xml
+        Placemark = ET.Element("Placemark")
+        Point = ET.SubElement(Placemark, "Point")
+        coordinates = ET.SubElement(Point, "coordinates")
+        coordinates.text = point["coordinates"]  # 航点经纬度<纬度,经度>
+        index = ET.SubElement(Placemark, "wpml:index")
+        index.text = str(point["index"])  # 航点序号
+        if is_template:
+            ellipsoidHeight = ET.SubElement(Placemark, "wpml:ellipsoidHeight")
+            ellipsoidHeight.text = point["altitude"]  # 全局航线高度（椭球高）
+            height = ET.SubElement(Placemark, "wpml:height")
+            height.text = point["altitude"]  # 全局航线高度（EGM96海拔高/相对起飞点高度/AGL相对地面高度）
+        else:
+            executeHeight = ET.SubElement(Placemark, "wpml:executeHeight")
+            executeHeight.text = point["altitude"]  # 航点执行高度
+            waypointSpeed = ET.SubElement(Placemark, "wpml:waypointSpeed")
+            waypointSpeed.text = point["speed"]  # 航点飞行速度，当前航点飞向下一个航点的速度
+        waypointHeadingParam = ET.SubElement(Placemark, "wpml:waypointHeadingParam")
+        waypointHeadingMode = ET.SubElement(waypointHeadingParam, "wpml:waypointHeadingMode")
+        waypointHeadingMode.text = "smoothTransition"  # 飞行器偏航角模式
+        waypointHeadingAngle = ET.SubElement(waypointHeadingParam, "wpml:waypointHeadingAngle")
+        waypointHeadingAngle.text = point["heading"]  # 飞行器偏航角度
+        waypointPoiPoint = ET.SubElement(waypointHeadingParam, "wpml:waypointPoiPoint")
+        waypointPoiPoint.text = "0.000000,0.000000,0.000000"  # 兴趣点
+        if not is_template:
+            waypointHeadingAngleEnable = ET.SubElement(waypointHeadingParam, "wpml:waypointHeadingAngleEnable")
+            waypointHeadingAngleEnable.text = "1"  # 未知
+        waypointHeadingPathMode = ET.SubElement(waypointHeadingParam, "wpml:waypointHeadingPathMode")
+        waypointHeadingPathMode.text = "followBadArc"  # 飞行器偏航角转动方向
+        waypointHeadingPoiIndex = ET.SubElement(waypointHeadingParam, "wpml:waypointHeadingPoiIndex")
+        waypointHeadingPoiIndex.text = "0"  # 未知
+        if is_template:
+            useGlobalSpeed = ET.SubElement(Placemark, "wpml:useGlobalSpeed")
+            useGlobalSpeed.text = "1"  # 是否使用全局飞行速度
+            useGlobalTurnParam = ET.SubElement(Placemark, "wpml:useGlobalTurnParam")
+            useGlobalTurnParam.text = "1"  # 是否使用全局航点类型（全局航点转弯模式）
+        else:
+            waypointTurnParam = ET.SubElement(Placemark, "wpml:waypointTurnParam")
+            waypointTurnMode = ET.SubElement(waypointTurnParam, "wpml:waypointTurnMode")
+            waypointTurnMode.text = "toPointAndStopWithDiscontinuityCurvature"  # 航点类型
+            waypointTurnDampingDist = ET.SubElement(waypointTurnParam, "wpml:waypointTurnDampingDist")
+            waypointTurnDampingDist.text = "0"  # 航点转弯截距
+        useStraightLine = ET.SubElement(Placemark, "wpml:useStraightLine")
+        if is_template:
+            useStraightLine.text = "0"  # 该航段是否贴合直线
+        else:
+            useStraightLine.text = "1"
+        if point["actions"] is not None:
+            actionGroup = ET.SubElement(Placemark, "wpml:actionGroup")
+            actionGroupId = ET.SubElement(actionGroup, "wpml:actionGroupId")
+            actionGroupId.text = str(point["actionGroupId"])  # 动作组id
+            actionGroupStartIndex = ET.SubElement(actionGroup, "wpml:actionGroupStartIndex")
+            actionGroupStartIndex.text = str(point["index"])  # 动作组开始生效的航点，即当前航点
+            actionGroupEndIndex = ET.SubElement(actionGroup, "wpml:actionGroupEndIndex")
+            actionGroupEndIndex.text = actionGroupStartIndex.text  # 动作组结束生效的航点
+            actionGroupMode = ET.SubElement(actionGroup, "wpml:actionGroupMode")
+            actionGroupMode.text = "sequence"  # 动作执行模式
+            actionTrigger = ET.SubElement(actionGroup, "wpml:actionTrigger")
+            actionTriggerType = ET.SubElement(actionTrigger, "wpml:actionTriggerType")
+            actionTriggerType.text = "reachPoint"  # 动作触发器类型
+            actionTrigger.tail = point["actions"]  # 各动作，见 makeFormats
+        if not is_template:
+            waypointGimbalHeadingParam = ET.SubElement(Placemark, "wpml:waypointGimbalHeadingParam")
+            waypointGimbalPitchAngle = ET.SubElement(waypointGimbalHeadingParam, "wpml:waypointGimbalPitchAngle")
+            waypointGimbalPitchAngle.text = "0"  # 未知
+            waypointGimbalYawAngle = ET.SubElement(waypointGimbalHeadingParam, "wpml:waypointGimbalYawAngle")
+            waypointGimbalYawAngle.text = "0"  # 未知
+        isRisky = ET.SubElement(Placemark, "wpml:isRisky")
+        isRisky.text = "0"  # 是否危险点
+        if not is_template:
+            waypointWorkType = ET.SubElement(Placemark, "wpml:waypointWorkType")
+            waypointWorkType.text = "0"  # 未知
+        return Placemark
+
+    def makeAction(self, actions_item):
+        # 动作类型与参数的 xml，两份文件中相同
+        xml, empty = ACTIONS.get(actions_item.action, UNKNOWN_ACTION)
+        return xml.format(param=escape(actions_item.param)) if actions_item.param else empty
 
+    def makeFormats(self, is_template):
+        # 航点与动作的 xml 格式串 (无动作的航点, 有动作的航点, 单个动作)：结构由 makePlacemark 生成一次，写出时逐航点填入字段
+        point = {name: FIELD % name for name in ("coordinates", "altitude", "heading", "speed", "index", "actionGroupId")}
+        plain = makeFormat(self.makePlacemark(dict(point, actions=None), is_template))
+        grouped = makeFormat(self.makePlacemark(dict(point, actions=FIELD % "actions"), is_template))
+        action = ET.Element("wpml:action")
+        actionId = ET.SubElement(action, "wpml:actionId")
+        actionId.text = FIELD % "actionId"  # 动作id，template.kml 中均为 0
+        actionId.tail = FIELD % "action"  # 动作类型与参数，见 makeAction
+        return plain, grouped, makeFormat(action)
+
+    def makeTail(self, Folder, is_template):
         if is_template:
             payloadParam = ET.SubElement(Folder, "wpml:payloadParam")
             payloadPositionIndex = ET.SubElement(payloadParam, "wpml:payloadPositionIndex")
             payloadPositionIndex.text = "0"  # 负载挂载位置
 
-        xml_str = ET.tostring(kml, encoding="utf-8")
-        content = xml_str.decode("utf-8")
-        content = '<?xml version="1.0" encoding="UTF-8"?>' + content
+    def getName(self, filepath):
+        filename_with_extension = os.path.basename(filepath)
+        filename, _ = os.path.splitext(filename_with_extension)
+        return filename
+
 
+def splitName(path, number):
+    # a.kmz -> a_1.kmz
+    root, ext = os.path.splitext(path)
+    return "%s_%d%s" % (root, number, ext)
+
+
+def writeChunk(conf, timestamp, info, mission, out):
+    # 拆分后单个 kmz 的写出任务，在子进程中执行；先写入临时文件再改名
+    app = ConvertKmz(timestamp=timestamp)
+    app.conf = conf
+    app.info = info
+    part = out + ".%d.part" % os.getpid()
+    try:
+        result = app.writeKmz(mission, part)
+        os.replace(part, out)
+    except Exception:
+        if os.path.exists(part):
+            os.remove(part)
+        raise
+    return result
+
+
+class BusyError(RuntimeError):
+    # 等待中的转换已达上限
+    pass
+
+
+def convertBytes(data, options=None):
+    # ConvertService 的转换任务，在进程池中执行
+    return ConvertKmz(**(options or {})).build(data)
+
+
+class ConvertService:
+    # asyncio 转换服务：kml bytes 转为 kmz bytes，转换放到进程池中执行
+    # 同时执行的转换不超过 limit 个，另有最多 backlog 个排队，再多的请求直接抛出 BusyError
+    def __init__(self, limit=None, backlog=None, options=None, executor=None):
+        self.limit = limit or os.cpu_count() or 1
+        self.backlog = self.limit * 4 if backlog is None else backlog
+        self.options = options or {}
+        self.executor = executor or ProcessPoolExecutor(self.limit)
+        self.semaphore = None
+        self.pending = 0  # 正在执行与排队中的转换数
+
+    def full(self):
+        return self.pending >= self.limit + self.backlog
+
+    async def convert(self, data):
+        if self.full():
+            raise BusyError("转换队列已满")
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.limit)
+        self.pending += 1
         try:
-            with open(os.path.join(self.temp_path, "wpmz", file), "w", encoding="UTF-8") as file:
-                file.write(content)
-        except:
-            status = "保存文件异常"
+            async with self.semaphore:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self.executor, convertBytes, bytes(data), self.options)
+        finally:
+            self.pending -= 1
 
-        return status
+    def close(self):
+        self.executor.shutdown()
 
-    def clearTemp(self):
-        if os.path.exists(self.temp_path):
-            shutil.rmtree(self.temp_path)
+    async def serve(self, host="127.0.0.1", port=8080, max_size=64 * 1024 * 1024):
+        # 简单的 HTTP 服务：POST /convert 提交 kml，返回 kmz；GET /health 返回当前负载
+        self.max_size = max_size
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
 
-    def getName(self, filepath):
-        filename_with_extension = os.path.basename(filepath)
-        filename, _ = os.path.splitext(filename_with_extension)
-        return filename
+    async def handle(self, reader, writer):
+        try:
+            method, target, _ = (await reader.readline()).decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            path = target.split("?", 1)[0]
+            if path == "/health" and method == "GET":
+                body = json.dumps({"pending": self.pending, "limit": self.limit, "backlog": self.backlog}).encode("utf-8")
+                await self.respond(writer, "200 OK", body, "application/json")
+            elif path != "/convert":
+                await self.respond(writer, "404 Not Found", b"not found")
+            elif method != "POST":
+                await self.respond(writer, "405 Method Not Allowed", b"use POST")
+            elif "content-length" not in headers:
+                await self.respond(writer, "411 Length Required", b"content-length required")
+            elif int(headers["content-length"]) > self.max_size:
+                await self.respond(writer, "413 Payload Too Large", b"kml too large")
+            elif self.full():
+                # 队列已满时不缓存请求体；回复后分块读取丢弃剩余数据再关闭，否则未读数据会使连接被重置，客户端收不到 503
+                await self.respond(writer, "503 Service Unavailable", "转换队列已满".encode("utf-8"), extra={"Retry-After": "1"})
+                await self.discard(reader, int(headers["content-length"]))
+            else:
+                data = await reader.readexactly(int(headers["content-length"]))
+                try:
+                    content = await self.convert(data)
+                except BusyError as e:
+                    await self.respond(writer, "503 Service Unavailable", str(e).encode("utf-8"), extra={"Retry-After": "1"})
+                except Exception as e:
+                    await self.respond(writer, "422 Unprocessable Entity", ("%s: %s" % (type(e).__name__, e)).encode("utf-8"))
+                else:
+                    await self.respond(writer, "200 OK", content, "application/vnd.google-earth.kmz")
+        except (ValueError, asyncio.IncompleteReadError):
+            await self.respond(writer, "400 Bad Request", b"bad request")
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def discard(self, reader, size):
+        while size > 0:
+            chunk = await reader.read(min(size, 65536))
+            if not chunk:
+                break
+            size -= len(chunk)
+
+    async def respond(self, writer, status, body, content_type="text/plain; charset=utf-8", extra=None):
+        headers = {"Content-Type": content_type, "Content-Length": str(len(body)), "Connection": "close"}
+        headers.update(extra or {})
+        head = "HTTP/1.1 %s\r\n%s\r\n\r\n" % (status, "\r\n".join("%s: %s" % item for item in headers.items()))
+        writer.write(head.encode("latin-1") + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+
+def convertFile(path, output_dir=None, options=None):
+    # 批量转换的单个任务，在子进程中执行；convert 先写入临时文件再改名，失败时不会留下不完整的 kmz
+    # options 为 ConvertKmz 的构造参数
+    started = time.time()
+    app = ConvertKmz(**(options or {}))
+    out = outputPath(path, output_dir)
+    try:
+        app.convert(path, out)
+        if app.split_files:
+            out = ", ".join(app.files)
+    except Exception as e:
+        return path, out, "%s: %s" % (type(e).__name__, e), time.time() - started
+    return path, out, False, time.time() - started
+
+
+def outputPath(path, output_dir=None):
+    # 批量转换时 kml 对应的 kmz 路径
+    return os.path.join(output_dir or os.path.dirname(path), ConvertKmz().getName(path) + ".kmz")
+
+
+def duplicateOutputs(paths, output_dir=None):
+    # 输出到同一 kmz 的 kml，例如 -o 时的 a/x.kml 与 b/x.kml，返回 {kmz: [kml, ...]}
+    outputs = {}
+    for path in paths:
+        outputs.setdefault(os.path.normcase(os.path.abspath(outputPath(path, output_dir))), []).append(path)
+    return {out: sources for out, sources in outputs.items() if len(sources) > 1}
+
+
+def measureFile(path, options=None):
+    # 只计算航线长度与预计时间，用于快速筛查
+    started = time.time()
+    try:
+        result = ConvertKmz(**(options or {})).measure(path)
+    except Exception as e:
+        return path, None, "%s: %s" % (type(e).__name__, e), time.time() - started
+    return path, result, False, time.time() - started
+
+
+def findKml(patterns):
+    # 支持文件、目录（目录下的 *.kml）与通配符
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths += sorted(glob.glob(os.path.join(pattern, "*.kml")))
+        elif glob.has_magic(pattern):
+            paths += sorted(glob.glob(pattern))
+        else:
+            paths.append(pattern)
+    return list(dict.fromkeys(paths))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="将大疆 kml 航线批量转换为 kmz")
+    parser.add_argument("paths", nargs="*", help="kml 文件、目录或通配符")
+    parser.add_argument("-o", "--output-dir", help="kmz 输出目录，默认与 kml 相同")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="并行进程数，默认为 CPU 核数")
+    parser.add_argument("--compact", action="store_true", help="先将航点读入紧凑的 Mission 再写出")
+    parser.add_argument("--measure", action="store_true", help="只输出航点数、航线长度与预计时间，不生成 kmz")
+    parser.add_argument("--cache", help="kmz 缓存目录，kml 与配置未变化时跳过转换")
+    parser.add_argument("--cache-size", type=int, default=256, help="缓存目录大小上限，MB")
+    parser.add_argument("--timestamp", type=int, help="固定 createTime/updateTime（Unix 毫秒），使输出可复现")
+    parser.add_argument("--simplify", type=float, metavar="METRES", help="去除偏离航线不超过该距离且无动作、航向不变的航点")
+    parser.add_argument("--max-waypoints", type=int, metavar="N", help="每条航线的航点数上限，超过时拆分为多条航线")
+    parser.add_argument("--max-distance", type=float, metavar="METRES", help="每条航线的长度上限（米），超过时拆分为多条航线")
+    parser.add_argument("--split-files", action="store_true", help="拆分后的每条航线单独生成 kmz（a_1.kmz、a_2.kmz……），而不是写在同一个 kmz 中")
+    parser.add_argument("--serve", metavar="HOST:PORT", help="以 HTTP 服务运行，POST /convert 提交 kml 返回 kmz")
+    parser.add_argument("--stdio", action="store_true", help="从标准输入读取 kml，向标准输出写出 kmz")
+    parser.add_argument("--backlog", type=int, help="服务模式下排队等待的转换上限，超过时返回 503，默认为并行数的 4 倍")
+    args = parser.parse_args(argv)
+    if args.max_waypoints is not None and args.max_waypoints < 2:
+        parser.error("--max-waypoints 至少为 2，每条航线至少需要 2 个航点")
+    options = {
+        "compact": args.compact,
+        "timestamp": args.timestamp,
+        "simplify": args.simplify,
+        "max_waypoints": args.max_waypoints,
+        "max_distance": args.max_distance,
+    }
+    if args.cache:
+        options["cache"] = KmzCache(args.cache, args.cache_size * 1024 * 1024)
+    if args.serve or args.stdio:
+        return serve(args, options)
+    if not args.paths:
+        parser.error("需要指定 kml 文件，或使用 --serve / --stdio")
+
+    paths = findKml(args.paths)
+    if args.split_files:
+        # 多个文件已按文件并行，单个文件内的各 kmz 不再另开进程
+        options.update(split_files=True, jobs=1 if args.jobs > 1 and len(paths) > 1 else args.jobs)
+    if args.measure:
+        task = functools.partial(measureFile, options=options)
+    else:
+        duplicates = duplicateOutputs(paths, args.output_dir)
+        if duplicates:
+            # 后转换的会覆盖先转换的，提前报错而不是静默覆盖
+            parser.error("以下 kml 会输出到同一个 kmz：" + "；".join("%s -> %s" % ("、".join(sources), out) for out, sources in duplicates.items()))
+        task = functools.partial(convertFile, output_dir=args.output_dir, options=options)
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+    started = time.time()
+    failed = 0
+    size = 0
+    if args.jobs > 1 and len(paths) > 1:
+        executor = ProcessPoolExecutor(min(args.jobs, len(paths)))
+        results = executor.map(task, paths)
+    else:
+        executor = None
+        results = map(task, paths)
+    try:
+        for path, out, status, seconds in results:
+            if status:
+                failed += 1
+                print("失败 %s: %s" % (path, status), file=sys.stderr)
+            elif args.measure:
+                size += os.path.getsize(path)
+                print("%s: %d 个航点，%.1f 米，%.1f 秒" % (path, out["waypoints"], out["distance"], out["duration"]))
+                for i, wayline in enumerate(out.get("waylines", ())):
+                    print("  航线 %d: %d 个航点，%.1f 米，%.1f 秒" % (i, wayline["waypoints"], wayline["distance"], wayline["duration"]))
+            else:
+                size += os.path.getsize(path)
+                print("完成 %s -> %s (%.2fs)" % (path, out, seconds))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    elapsed = max(time.time() - started, 1e-9)
+    print(
+        "共 %d 个文件，成功 %d，失败 %d，用时 %.2fs，%.1f 个/秒，%.2f MB/s"
+        % (len(paths), len(paths) - failed, failed, elapsed, len(paths) / elapsed, size / elapsed / 1e6)
+    )
+    return 1 if failed else 0
+
+
+def serve(args, options):
+    if args.stdio:
+        service = ConvertService(1, options=options, executor=ThreadPoolExecutor(1))
+        try:
+            content = asyncio.run(service.convert(sys.stdin.buffer.read()))
+        except Exception as e:
+            print("失败: %s: %s" % (type(e).__name__, e), file=sys.stderr)
+            return 1
+        finally:
+            service.close()
+        sys.stdout.buffer.write(content)
+        sys.stdout.buffer.flush()
+        return 0
+    host, _, port = args.serve.rpartition(":")
+    service = ConvertService(args.jobs, args.backlog, options)
+    print("监听 http://%s:%s/convert" % (host or "127.0.0.1", port), file=sys.stderr)
+    try:
+        asyncio.run(service.serve(host or "127.0.0.1", int(port)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+    return 0
 
 
 if __name__ == "__main__":
-    app = ConvertKmz()
+    sys.exit(main())
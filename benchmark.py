@@ -0,0 +1,177 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+from ConvertKmz import ACTIONS, ConvertKmz, Mission, numpy
+
+PHASES = ("info", "parse", "write", "save")
+# 各动作 param 的取值范围，未列出的动作为 0
+PARAMS = {
+    "GimbalPitch": (-90, 0),  # 云台俯仰角
+    "AircraftYaw": (-180, 180),  # 飞行器偏航角
+    "Hovering": (1, 10),  # 悬停时间，秒
+}
+
+
+def makeMission(path, waypoints, actions=1, mix=None, seed=0):
+    # 生成大疆 kml 格式的测试航线：蛇形扫描，每个航点 actions 个动作，动作从 mix 中随机选取
+    mix = mix or sorted(ACTIONS)
+    rnd = random.Random(seed)
+    row = max(int(waypoints ** 0.5), 1)
+    with open(path, "w", encoding="utf-8") as file:
+        file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        file.write('<kml xmlns="http://www.opengis.net/kml/2.2"><Document xmlns="">')
+        file.write("<name>benchmark</name><open>1</open>")
+        file.write('<ExtendedData xmlns:mis="www.dji.com"><mis:type>Waypoint</mis:type></ExtendedData>')
+        file.write("<Folder><name>Waypoints</name>")
+        for i in range(waypoints):
+            line, step = divmod(i, row)
+            if line % 2:
+                step = row - 1 - step
+            file.write('<Placemark><name>Waypoint%d</name><ExtendedData xmlns:mis="www.dji.com">' % (i + 1))
+            file.write("<mis:heading>%d</mis:heading><mis:speed>5.0</mis:speed>" % (0 if line % 2 else 180))
+            for _ in range(actions):
+                action = rnd.choice(mix)
+                file.write('<mis:actions param="%d" accuracy="0">%s</mis:actions>' % (rnd.randint(*PARAMS.get(action, (0, 0))), action))
+            file.write("</ExtendedData><Point><altitudeMode>relativeToGround</altitudeMode>")
+            file.write("<coordinates>%.8f,%.8f,%.1f</coordinates></Point></Placemark>" % (114.0 + step * 5e-5, 22.5 + line * 5e-5, 100.0))
+        file.write('</Folder><Placemark><name>Wayline</name><ExtendedData xmlns:mis="www.dji.com">')
+        file.write("<mis:altitude>100.0</mis:altitude><mis:autoFlightSpeed>10.0</mis:autoFlightSpeed>")
+        file.write("</ExtendedData></Placemark></Document></kml>")
+
+
+def runPhases(path, out, trace):
+    # compact 路径：依次执行各阶段，返回 {阶段: (秒, 峰值内存字节)}
+    app = ConvertKmz()
+    results = {}
+
+    def phase(name, func):
+        if trace:
+            tracemalloc.start()
+        started = time.perf_counter()
+        value = func()
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] if trace else 0
+        if trace:
+            tracemalloc.stop()
+        results[name] = (elapsed, peak)
+        return value
+
+    app.info = phase("info", lambda: app.getKmlInfo(path))
+    mission = phase("parse", lambda: Mission.load(app.iterKmlWaypoints(path)))
+    buffer = io.BytesIO()
+    phase("write", lambda: app.writeKmz(mission, buffer))
+    phase("save", lambda: app.save(buffer.getvalue(), out))
+    return results, len(buffer.getvalue())
+
+
+def runStream(path, out):
+    # 默认的流式路径：ConvertKmz().convert 边解析边写入 kmz 文件，返回秒数
+    started = time.perf_counter()
+    ConvertKmz().convert(path, out)
+    return time.perf_counter() - started
+
+
+def benchmark(waypoints, actions, mix, repeat):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "mission.kml")
+        out = os.path.join(directory, "mission.kmz")
+        makeMission(path, waypoints, actions, mix)
+        # 计时取多次中的最小值；内存单独跑一遍，避免 tracemalloc 影响计时
+        times = {name: float("inf") for name in PHASES}
+        stream = float("inf")
+        for _ in range(repeat):
+            results, size = runPhases(path, out, False)
+            for name in PHASES:
+                times[name] = min(times[name], results[name][0])
+            stream = min(stream, runStream(path, out))
+        memory, _ = runPhases(path, out, True)
+        # 流式路径各阶段的耗时与峰值内存由 ConvertKmz 自身统计
+        stream_phases = ConvertKmz(instrument="memory").convert(path, out)["phases"]
+        input_size = os.path.getsize(path)
+    total = sum(times.values())
+    return {
+        "waypoints": waypoints,
+        "actions": actions,
+        "input_bytes": input_size,
+        "output_bytes": size,
+        "total_seconds": total,
+        "waypoints_per_second": waypoints / total,
+        "phases": {
+            name: {
+                "seconds": times[name],
+                "waypoints_per_second": waypoints / times[name] if times[name] else None,
+                "peak_bytes": memory[name][1],
+            }
+            for name in PHASES
+        },
+        "stream": {
+            "seconds": stream,
+            "waypoints_per_second": waypoints / stream,
+            "phases": stream_phases,
+        },
+    }
+
+
+def compare(old, new):
+    # 按航点数、动作数对应比较两次结果，输出耗时比例（>1 表示变慢）
+    previous = {(run["waypoints"], run["actions"]): run for run in old["runs"]}
+    for run in new["runs"]:
+        base = previous.get((run["waypoints"], run["actions"]))
+        if base is None:
+            continue
+        ratios = ["%s %.2fx" % (name, run["phases"][name]["seconds"] / base["phases"][name]["seconds"]) for name in PHASES if base["phases"][name]["seconds"]]
+        if "stream" in base:
+            ratios.append("stream %.2fx" % (run["stream"]["seconds"] / base["stream"]["seconds"]))
+        print("%d 航点 × %d 动作: 总计 %.2fx，%s" % (run["waypoints"], run["actions"], run["total_seconds"] / base["total_seconds"], "，".join(ratios)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ConvertKmz 性能测试")
+    parser.add_argument("-n", "--waypoints", type=int, nargs="+", default=[1000, 10000, 50000], help="航点数，可指定多个")
+    parser.add_argument("-a", "--actions", type=int, default=1, help="每个航点的动作数")
+    parser.add_argument("--mix", nargs="+", help="参与随机选取的动作，默认为全部已注册动作")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="重复次数，计时取最小值")
+    parser.add_argument("-o", "--output", help="结果保存为 json")
+    parser.add_argument("--compare", help="与之前保存的 json 结果比较")
+    args = parser.parse_args(argv)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": numpy.__version__ if numpy is not None else None,
+        "created": int(time.time()),
+        "runs": [],
+    }
+    for waypoints in args.waypoints:
+        run = benchmark(waypoints, args.actions, args.mix, args.repeat)
+        report["runs"].append(run)
+        print(
+            "%d 航点 × %d 动作: %.3fs，%.0f 航点/秒，输出 %.1f KB"
+            % (waypoints, args.actions, run["total_seconds"], run["waypoints_per_second"], run["output_bytes"] / 1024)
+        )
+        for name in PHASES:
+            phase = run["phases"][name]
+            print("  %-6s %8.3fs  峰值内存 %8.1f KB" % (name, phase["seconds"], phase["peak_bytes"] / 1024))
+        stream = run["stream"]
+        print("  stream %8.3fs  %.0f 航点/秒（默认流式路径）" % (stream["seconds"], stream["waypoints_per_second"]))
+        for name, phase in stream["phases"].items():
+            print("    %-6s %8.3fs  峰值内存 %8.1f KB" % (name, phase["seconds"], phase["peak_bytes"] / 1024))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            compare(json.load(file), report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
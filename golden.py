@@ -0,0 +1,186 @@
+import io
+import os
+import sys
+import zipfile
+import argparse
+import xml.etree.ElementTree as ET
+
+from ConvertKmz import ConvertKmz, Mission, Waypoint, localName, simplifyMission
+
+# golden/<名称>.kml 为输入，golden/<名称>/wpmz/ 下为原版转换器生成的 template.kml 与 waylines.wpml
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+IGNORED = ("createTime", "updateTime")
+ACTION_GROUP_INDEX = ("actionGroupStartIndex", "actionGroupEndIndex")
+# 有意与原版不同的字段：原版航线长度与预计时间固定写 0
+OVERRIDES = {
+    "demo": {"distance": "105.52", "duration": "24.1"},
+}
+# 需要输出一致的几种写出方式
+VARIANTS = {
+    "stream": {},
+    "compact": {"compact": True},
+}
+
+
+def sameText(expected, actual):
+    # 数字按数值比较，忽略 5.0 / 5、114.06000000 / 114.06 这类格式差异
+    expected = (expected or "").strip()
+    actual = (actual or "").strip()
+    if expected == actual:
+        return True
+    try:
+        return [float(value) for value in expected.split(",")] == [float(value) for value in actual.split(",")]
+    except ValueError:
+        return False
+
+
+def compareTree(expected, actual, overrides, path, errors, index=None):
+    tag = localName(expected.tag)
+    path = "%s/%s" % (path, tag)
+    if localName(actual.tag) != tag:
+        errors.append("%s: 节点为 %s" % (path, localName(actual.tag)))
+        return
+    if tag == "Placemark":
+        for child in expected:
+            if localName(child.tag) == "index":
+                index = child.text
+        path += "[%s]" % index
+    if tag in IGNORED:
+        text = None
+    elif tag in ACTION_GROUP_INDEX:
+        # 原版为 actionGroupId + 1，现为动作所在航点的序号
+        text = index
+    else:
+        text = overrides.get(tag, expected.text)
+    if text is not None and not sameText(text, actual.text):
+        errors.append("%s: 应为 %r，实际为 %r" % (path, text, actual.text))
+    if expected.attrib != actual.attrib:
+        errors.append("%s: 属性应为 %r，实际为 %r" % (path, expected.attrib, actual.attrib))
+    if [localName(child.tag) for child in expected] != [localName(child.tag) for child in actual]:
+        errors.append("%s: 子节点应为 %s，实际为 %s" % (path, [localName(child.tag) for child in expected], [localName(child.tag) for child in actual]))
+        return
+    for expected_child, actual_child in zip(expected, actual):
+        compareTree(expected_child, actual_child, overrides, path, errors, index)
+
+
+def check(name, options):
+    # 返回与原版输出的差异列表
+    path = os.path.join(GOLDEN_DIR, name + ".kml")
+    golden = os.path.join(GOLDEN_DIR, name)
+    errors = []
+    with zipfile.ZipFile(io.BytesIO(ConvertKmz(**options).build(path))) as kmz:
+        names = sorted(entry for entry in kmz.namelist() if not entry.endswith("/"))
+        expected_names = sorted("wpmz/" + entry for entry in os.listdir(os.path.join(golden, "wpmz")))
+        if names != expected_names:
+            errors.append("文件应为 %s，实际为 %s" % (expected_names, names))
+        for entry in expected_names:
+            if entry not in names:
+                continue
+            expected = ET.parse(os.path.join(golden, entry)).getroot()
+            actual = ET.fromstring(kmz.read(entry))
+            compareTree(expected, actual, OVERRIDES.get(name, {}), entry, errors)
+    return errors
+
+
+def checkSimplify():
+    # 共线航点航向 0→90 变化：变化前后的两个航点都要保留，偏航仍在原航段内完成
+    mission = Mission()
+    for i, heading in enumerate((0, 0, 0, 0, 90, 90, 90)):
+        mission.append(Waypoint(114 + i * 1e-4, 22.5, 100.0, float(heading), 0.0, ()))
+    kept = [round((lon - 114) / 1e-4) for lon in simplifyMission(mission, 1.0).lon]
+    if kept != [0, 3, 4, 6]:
+        return ["保留的航点应为 [0, 3, 4, 6]，实际为 %s" % kept]
+    return []
+
+
+def childText(element, tag):
+    for child in element:
+        if localName(child.tag) == tag:
+            return child.text
+    return None
+
+
+def checkSplit():
+    # 拆分 golden/demo.kml：每条航线至少 2 个航点、相邻航线首尾相接，航点序号、动作组 id、航线 id 各自从 0 开始，
+    # 各航线长度与预计时间之和等于不拆分时的结果
+    path = os.path.join(GOLDEN_DIR, "demo.kml")
+    total = ConvertKmz().measure(path)
+    errors = []
+    for options in ({"max_waypoints": 3}, {"max_distance": 20}, {"max_distance": 1}):
+        with zipfile.ZipFile(io.BytesIO(ConvertKmz(**options).build(path))) as kmz:
+            template = ET.fromstring(kmz.read("wpmz/template.kml"))
+            waylines = ET.fromstring(kmz.read("wpmz/waylines.wpml"))
+        prefix = "%s: " % options
+        distance = duration = 0.0
+        last = None
+        folders = [element for element in waylines.iter() if localName(element.tag) == "Folder"]
+        templates = [element for element in template.iter() if localName(element.tag) == "Folder"]
+        if len(folders) < 2 or len(folders) != len(templates):
+            errors.append(prefix + "航线数为 %d，模板数为 %d" % (len(folders), len(templates)))
+        for wayline_id, (folder, template_folder) in enumerate(zip(folders, templates)):
+            ids = (childText(folder, "templateId"), childText(folder, "waylineId"), childText(template_folder, "templateId"))
+            if ids != (str(wayline_id),) * 3:
+                errors.append(prefix + "航线 %d 的 templateId/waylineId 为 %s" % (wayline_id, ids))
+            distance += float(childText(folder, "distance"))
+            duration += float(childText(folder, "duration"))
+            placemarks = [child for child in folder if localName(child.tag) == "Placemark"]
+            if len(placemarks) < 2:
+                errors.append(prefix + "航线 %d 只有 %d 个航点" % (wayline_id, len(placemarks)))
+                continue
+            if [childText(placemark, "index") for placemark in placemarks] != [str(i) for i in range(len(placemarks))]:
+                errors.append(prefix + "航线 %d 的航点序号没有从 0 开始连续编号" % wayline_id)
+            groups = [element for placemark in placemarks for element in placemark if localName(element.tag) == "actionGroup"]
+            if [childText(group, "actionGroupId") for group in groups] != [str(i) for i in range(len(groups))]:
+                errors.append(prefix + "航线 %d 的动作组 id 没有从 0 开始连续编号" % wayline_id)
+            for placemark in placemarks:
+                for element in placemark:
+                    if localName(element.tag) == "actionGroup" and childText(element, "actionGroupStartIndex") != childText(placemark, "index"):
+                        errors.append(prefix + "航线 %d 航点 %s 的动作组起始序号不是所在航点" % (wayline_id, childText(placemark, "index")))
+            coordinates = [element.text for placemark in placemarks for element in placemark.iter() if localName(element.tag) == "coordinates"]
+            if last is not None and coordinates[0] != last:
+                errors.append(prefix + "航线 %d 没有从上一条航线的末航点开始" % wayline_id)
+            last = coordinates[-1]
+        # 各航线的值分别保留两位小数
+        tolerance = 0.01 * len(folders)
+        if abs(distance - total["distance"]) > tolerance or abs(duration - total["duration"]) > tolerance:
+            errors.append(prefix + "各航线长度、时间之和为 %.2f 米、%.2f 秒，应为 %.2f 米、%.2f 秒" % (distance, duration, total["distance"], total["duration"]))
+    try:
+        ConvertKmz(max_waypoints=1)
+        errors.append("max_waypoints=1 应抛出 ValueError")
+    except ValueError:
+        pass
+    return errors
+
+
+# 不依赖原版输出的检查，返回差异列表
+CHECKS = {
+    "simplify": checkSimplify,
+    "split": checkSplit,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="将转换结果与原版转换器的输出（golden/）比较")
+    parser.add_argument("names", nargs="*", help="要检查的航线，默认为 golden/ 下全部 kml")
+    args = parser.parse_args(argv)
+    names = args.names or sorted(os.path.splitext(name)[0] for name in os.listdir(GOLDEN_DIR) if name.endswith(".kml"))
+    failed = 0
+    for name in names:
+        for variant, options in VARIANTS.items():
+            errors = check(name, options)
+            print("%s %s: %s" % ("失败" if errors else "通过", name, variant))
+            for error in errors:
+                print("  " + error)
+            failed += bool(errors)
+    if not args.names:
+        for name, func in CHECKS.items():
+            errors = func()
+            print("%s %s" % ("失败" if errors else "通过", name))
+            for error in errors:
+                print("  " + error)
+            failed += bool(errors)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())